@@ -2,12 +2,23 @@
 """Generate Feiertage and Ferien ICS files for all 16 German Bundesländer."""
 
 import argparse
+import functools
 import hashlib
+import http.client
 import json
 import os
+import threading
+import urllib.error
 import urllib.parse
-import urllib.request
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta, timezone
+from operator import itemgetter
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional; the stdlib parser gives the same result, only slower
+    json_loads = json.loads
 
 
 PRODID = "ics.tools skjerns patch"
@@ -15,6 +26,9 @@ URL = "https://ics.tools"
 FEIERTAGE_API = "https://feiertage-api.de/api/"
 FERIEN_API = "https://openholidaysapi.org/SchoolHolidays"
 MAX_BATCH_DAYS = 1000
+MAX_CONNECTIONS = 32
+TARGETS = ("feiertage", "ferien")
+ONE_DAY = timedelta(days=1)
 
 # feiertage-api.de land codes
 FEIERTAGE_CODES = {
@@ -36,51 +50,125 @@ FEIERTAGE_CODES = {
     "thüringen":              "TH",
 }
 
-# openholidaysapi.org subdivision codes
-SUBDIVISION_CODES = {
-    "baden-württemberg":      "DE-BW",
-    "bayern":                 "DE-BY",
-    "berlin":                 "DE-BE",
-    "brandenburg":            "DE-BB",
-    "bremen":                 "DE-HB",
-    "hamburg":                "DE-HH",
-    "hessen":                 "DE-HE",
-    "mecklenburg-vorpommern": "DE-MV",
-    "niedersachsen":          "DE-NI",
-    "nordrhein-westfalen":    "DE-NW",
-    "rheinland-pfalz":        "DE-RP",
-    "saarland":               "DE-SL",
-    "sachsen-anhalt":         "DE-ST",
-    "sachsen":                "DE-SN",
-    "schleswig-holstein":     "DE-SH",
-    "thüringen":              "DE-TH",
-}
+# openholidaysapi.org subdivision codes are the ISO 3166-2 form of the same land codes
+SUBDIVISION_CODES = {state: f"DE-{code}" for state, code in FEIERTAGE_CODES.items()}
 
 STATES = list(FEIERTAGE_CODES.keys())
 
-
-def fetch_feiertage_api(land_code: str, year: int) -> list[tuple[date, str]]:
-    """Fetch public holidays from feiertage-api.de for a given state and year."""
-    params = urllib.parse.urlencode({"jahr": year, "nur_land": land_code})
-    req = urllib.request.Request(
-        f"{FEIERTAGE_API}?{params}",
-        headers={"Accept": "application/json"},
-    )
-    with urllib.request.urlopen(req) as resp:
-        data = json.loads(resp.read())
-    return sorted(
-        (date.fromisoformat(v["datum"]), name)
-        for name, v in data.items()
-    )
-
-
+# Idle keep-alive connections per host, shared by all worker threads
+_idle_connections: dict[str, list[http.client.HTTPSConnection]] = {}
+_idle_lock = threading.Lock()
+# Caps the requests in flight across all thread pools, so the APIs are not flooded
+_request_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+
+def _acquire_connection(host: str) -> http.client.HTTPSConnection:
+    with _idle_lock:
+        idle = _idle_connections.get(host)
+        if idle:
+            return idle.pop()
+    return http.client.HTTPSConnection(host)
+
+
+def _release_connection(host: str, conn: http.client.HTTPSConnection) -> None:
+    with _idle_lock:
+        _idle_connections.setdefault(host, []).append(conn)
+
+
+def get_json(url: str):
+    """GET and decode a JSON document, reusing a persistent HTTPS connection to the host.
+
+    Unlike urllib.request.urlopen, redirects are not followed (a 3xx raises HTTPError)
+    and HTTPS_PROXY is not honoured; both APIs answer directly with 200.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+    with _request_slots:
+        for attempt in range(2):
+            if attempt:
+                conn = http.client.HTTPSConnection(parts.netloc)
+            else:
+                conn = _acquire_connection(parts.netloc)
+            try:
+                conn.request("GET", path, headers={"Accept": "application/json"})
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # An idle connection may have been dropped by the server; retry once on a fresh one
+                conn.close()
+                if attempt:
+                    raise
+        _release_connection(parts.netloc, conn)
+    if resp.status != 200:
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, None)
+    return json_loads(body)
+
+
+def fetch_feiertage_json(year: int, cache_dir: str) -> dict:
+    """Fetch the raw feiertage-api.de response for a year, cached on disk once the year is over."""
+    cache_path = os.path.join(cache_dir, f"feiertage-{year}.json")
+    # Holidays of a past year no longer change; current and future years are always refetched
+    cacheable = year < date.today().year
+    if cacheable and os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return json_loads(f.read())
+
+    params = urllib.parse.urlencode({"jahr": year})
+    data = get_json(f"{FEIERTAGE_API}?{params}")
+    if cacheable:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    return data
+
+
+def fetch_feiertage_year(year: int, cache_dir: str) -> dict[str, list[tuple[date, str]]]:
+    """Fetch public holidays of all states for a year from feiertage-api.de, keyed by land code."""
+    data = fetch_feiertage_json(year, cache_dir)
+    # Most holidays fall on the same day in every state; parse each date once
+    days: dict[str, date] = {}
+    holidays = {}
+    for code in FEIERTAGE_CODES.values():
+        entries = []
+        for name, v in data[code].items():
+            day = days.get(v["datum"])
+            if day is None:
+                day = days[v["datum"]] = date.fromisoformat(v["datum"])
+            entries.append((day, name))
+        entries.sort()
+        holidays[code] = entries
+    return holidays
+
+
+def fetch_feiertage_api(year_start: int, year_end: int,
+                        cache_dir: str) -> dict[int, dict[str, list[tuple[date, str]]]]:
+    """Fetch public holidays of all states for a range of years, keyed by year and land code."""
+    years = range(year_start, year_end + 1)
+    # One request per year; keep them all in flight and collate in year order
+    with ThreadPoolExecutor(max_workers=min(32, len(years))) as executor:
+        return dict(zip(years, executor.map(lambda y: fetch_feiertage_year(y, cache_dir), years)))
+
+
+@functools.lru_cache(maxsize=None)
+def ics_date(day: date) -> str:
+    """Format a date as YYYYMMDD; the same few thousand dates recur across all states."""
+    return f"{day.year:04d}{day.month:02d}{day.day:02d}"
+
+
+@functools.lru_cache(maxsize=None)
 def make_uid(summary: str, dtstart: date) -> str:
-    raw = f"{summary}{dtstart.strftime('%Y%m%d')}"
-    return hashlib.sha256(raw.encode()).hexdigest()[:8]
+    raw = f"{summary}{ics_date(dtstart)}"
+    # Hex-format only the 4 bytes kept instead of all 32; same value as hexdigest()[:8]
+    return hashlib.sha256(raw.encode()).digest()[:4].hex()
 
 
 def ics_fold(line: str) -> str:
     """RFC 5545 line folding: max 75 octets per line, continuation with CRLF + space."""
+    if len(line) <= 75 and line.isascii():
+        return line  # one octet per char, no need to encode
     encoded = line.encode("utf-8")
     if len(encoded) <= 75:
         return line
@@ -88,20 +176,25 @@ def ics_fold(line: str) -> str:
     pos = 0
     limit = 75
     while pos < len(encoded):
-        chunks.append(encoded[pos:pos + limit].decode("utf-8", errors="ignore"))
-        pos += limit
+        end = min(pos + limit, len(encoded))
+        # Never split a multi-byte character: back off while end points at a continuation byte
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        chunks.append(encoded[pos:end].decode("utf-8"))
+        pos = end
         limit = 74  # continuation lines have 1 char less (the leading space)
     return "\r\n ".join(chunks)
 
 
-def vevent(summary: str, dtstart: date, dtend: date, timestamp: str) -> str:
-    uid = make_uid(summary, dtstart)
+@functools.lru_cache(maxsize=None)
+def vevent_template(timestamp: str) -> str:
+    """VEVENT format string with everything that is constant within a run filled in."""
     lines = [
         "BEGIN:VEVENT",
-        f"DTSTART;VALUE=DATE:{dtstart.strftime('%Y%m%d')}",
-        f"DTEND;VALUE=DATE:{dtend.strftime('%Y%m%d')}",
-        f"SUMMARY:{summary}",
-        ics_fold(f"UID:{uid}"),
+        "DTSTART;VALUE=DATE:{dtstart}",
+        "DTEND;VALUE=DATE:{dtend}",
+        "{summary}",
+        "UID:{uid}",  # 8 hex chars, never needs folding
         f"URL:{URL}",
         f"CREATED:{timestamp}",
         f"LAST-MODIFIED:{timestamp}",
@@ -112,64 +205,79 @@ def vevent(summary: str, dtstart: date, dtend: date, timestamp: str) -> str:
     return "\r\n".join(lines)
 
 
-def write_feiertage(state: str, year_start: int, year_end: int,
-                    output_dir: str, timestamp: str) -> None:
-    cal_name = f"{state.title()} Feiertage"
-    code = FEIERTAGE_CODES[state]
-    events = []
-    for year in range(year_start, year_end + 1):
-        for day, name in fetch_feiertage_api(code, year):
-            dtend = day + timedelta(days=1)
-            events.append(vevent(name, day, dtend, timestamp))
-
-    parts = [
-        "BEGIN:VCALENDAR",
-        "VERSION:2.0",
-        f"PRODID:{PRODID}",
-        *events,
-        f"NAME:{cal_name}",
-        f"X-WR-CALNAME:{cal_name}",
-        "METHOD:PUBLISH",
-        "END:VCALENDAR",
-    ]
-    content = "\r\n".join(parts) + "\r\n"
+def vevent(summary: str, dtstart: date, dtend: date, timestamp: str) -> str:
+    return vevent_template(timestamp).format(
+        dtstart=ics_date(dtstart),
+        dtend=ics_date(dtend),
+        summary=ics_fold(f"SUMMARY:{summary}"),
+        uid=make_uid(summary, dtstart),
+    )
 
+
+def write_calendar(state: str, cal_name: str, events: Iterable[str], output_dir: str) -> None:
+    """Write <output_dir>/<state>.ics, streaming the events into a buffered binary file."""
     os.makedirs(output_dir, exist_ok=True)
     out_path = os.path.join(output_dir, f"{state}.ics")
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(content)
+    with open(out_path, "wb", buffering=1 << 20) as f:
+        f.write(f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:{PRODID}\r\n".encode())
+        for event in events:
+            f.write(event.encode("utf-8"))
+            f.write(b"\r\n")
+        f.write((
+            f"NAME:{cal_name}\r\n"
+            f"X-WR-CALNAME:{cal_name}\r\n"
+            "METHOD:PUBLISH\r\n"
+            "END:VCALENDAR\r\n"
+        ).encode("utf-8"))
     print(f"  → {out_path}")
 
 
+def write_feiertage(state: str, feiertage: dict[int, dict[str, list[tuple[date, str]]]],
+                    output_dir: str, timestamp: str) -> None:
+    cal_name = f"{state.title()} Feiertage"
+    code = FEIERTAGE_CODES[state]
+    events = (
+        vevent(name, day, day + ONE_DAY, timestamp)
+        for by_state in feiertage.values()
+        for day, name in by_state[code]
+    )
+    write_calendar(state, cal_name, events, output_dir)
+
+
+def generate_feiertage(year_start: int, year_end: int, output_dir: str,
+                       cache_dir: str, timestamp: str) -> None:
+    feiertage = fetch_feiertage_api(year_start, year_end, cache_dir)
+    # Writing is pure CPU work once the table is fetched, so threads would not help here
+    for state in STATES:
+        write_feiertage(state, feiertage, output_dir, timestamp)
+
+
 def fetch_ferien_api(subdivision_code: str, from_date: date, to_date: date) -> list[dict]:
     """Fetch school holidays from OpenHolidays API in batches of at most MAX_BATCH_DAYS days."""
-    results = []
+    batches = []
     current = from_date
     while current <= to_date:
         batch_end = min(current + timedelta(days=MAX_BATCH_DAYS - 1), to_date)
+        batches.append((current, batch_end))
+        current = batch_end + ONE_DAY
+
+    def fetch_batch(batch: tuple[date, date]) -> list[dict]:
         params = urllib.parse.urlencode({
             "countryIsoCode": "DE",
             "subdivisionCode": subdivision_code,
-            "validFrom": current.strftime("%Y-%m-%d"),
-            "validTo":   batch_end.strftime("%Y-%m-%d"),
+            "validFrom": batch[0].isoformat(),
+            "validTo":   batch[1].isoformat(),
         })
-        req = urllib.request.Request(
-            f"{FERIEN_API}?{params}",
-            headers={"Accept": "application/json"},
-        )
-        with urllib.request.urlopen(req) as resp:
-            results.extend(json.loads(resp.read()))
-        current = batch_end + timedelta(days=1)
-
-    # Deduplicate entries that appear in overlapping batch windows
-    seen: set[tuple] = set()
-    unique = []
-    for item in results:
-        key = (item["startDate"], item["endDate"])
-        if key not in seen:
-            seen.add(key)
-            unique.append(item)
-    return unique
+        return get_json(f"{FERIEN_API}?{params}")
+
+    # The API is stateless, so all batches can be in flight at once. Entries that
+    # overlap two batch windows are returned twice; keep the first one.
+    unique: dict[tuple[str, str], dict] = {}
+    with ThreadPoolExecutor(max_workers=min(8, len(batches))) as executor:
+        for batch_results in executor.map(fetch_batch, batches):
+            for item in batch_results:
+                unique.setdefault((item["startDate"], item["endDate"]), item)
+    return list(unique.values())
 
 
 def german_name(name_list: list[dict]) -> str:
@@ -185,36 +293,22 @@ def write_ferien(state: str, year_start: int, year_end: int,
     state_title = state.title()
     cal_name = f"{state_title} Ferien"
 
-    print(f"  {state} ({code}) ...", end="", flush=True)
     holidays = fetch_ferien_api(code, date(year_start, 1, 1), date(year_end, 12, 31))
-    print(f" {len(holidays)} entries")
-
-    events = []
-    for h in sorted(holidays, key=lambda x: x["startDate"]):
-        name = german_name(h["name"])
-        start = date.fromisoformat(h["startDate"])
-        # API endDate is the last inclusive day; ICS DTEND is exclusive
-        end = date.fromisoformat(h["endDate"]) + timedelta(days=1)
-        summary = f"{name} {start.year} {state_title}"
-        events.append(vevent(summary, start, end, timestamp))
-
-    parts = [
-        "BEGIN:VCALENDAR",
-        "VERSION:2.0",
-        f"PRODID:{PRODID}",
-        *events,
-        f"NAME:{cal_name}",
-        f"X-WR-CALNAME:{cal_name}",
-        "METHOD:PUBLISH",
-        "END:VCALENDAR",
-    ]
-    content = "\r\n".join(parts) + "\r\n"
+    print(f"  {state} ({code}) {len(holidays)} entries")
 
-    os.makedirs(output_dir, exist_ok=True)
-    out_path = os.path.join(output_dir, f"{state}.ics")
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(content)
-    print(f"  → {out_path}")
+    # ISO dates sort chronologically as strings; sort the fresh list in place
+    holidays.sort(key=itemgetter("startDate"))
+
+    def events() -> Iterator[str]:
+        for h in holidays:
+            name = german_name(h["name"])
+            start = date.fromisoformat(h["startDate"])
+            # API endDate is the last inclusive day; ICS DTEND is exclusive
+            end = date.fromisoformat(h["endDate"]) + ONE_DAY
+            summary = f"{name} {start.year} {state_title}"
+            yield vevent(summary, start, end, timestamp)
+
+    write_calendar(state, cal_name, events(), output_dir)
 
 
 def main() -> None:
@@ -227,20 +321,45 @@ def main() -> None:
                         help="Output directory for Feiertage (default: Feiertage/)")
     parser.add_argument("--ferien_dir", default="Ferien",
                         help="Output directory for Ferien (default: Ferien/)")
+    parser.add_argument("--cache_dir", default=".cache",
+                        help="Cache directory for API responses of past years (default: .cache/)")
+    parser.add_argument("--targets", default=",".join(TARGETS),
+                        help=f"Comma-separated calendars to generate (default: {','.join(TARGETS)})")
     args = parser.parse_args()
 
     if args.year_start > args.year_end:
         parser.error("year_start must be <= year_end")
+    targets = set(args.targets.split(","))
+    if not targets <= set(TARGETS):
+        parser.error(f"targets must be a comma-separated subset of {','.join(TARGETS)}")
 
     timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
 
-    print(f"Generating Feiertage {args.year_start}–{args.year_end} → {args.feiertage_dir}/")
-    for state in STATES:
-        write_feiertage(state, args.year_start, args.year_end, args.feiertage_dir, timestamp)
-
-    print(f"\nFetching Ferien {args.year_start}–{args.year_end} → {args.ferien_dir}/")
-    for state in STATES:
-        write_ferien(state, args.year_start, args.year_end, args.ferien_dir, timestamp)
+    # The jobs' progress lines interleave, so announce the combined run once; every
+    # line names the file or state it belongs to.
+    outputs = []
+    if "feiertage" in targets:
+        outputs.append(f"Feiertage → {args.feiertage_dir}/")
+    if "ferien" in targets:
+        outputs.append(f"Ferien → {args.ferien_dir}/")
+    print(f"Generating {args.year_start}–{args.year_end}: {', '.join(outputs)}")
+
+    # All fetching is network-bound: run the Feiertage pipeline and every Ferien
+    # state at the same time, so the run takes as long as the slowest of them.
+    with ThreadPoolExecutor(max_workers=len(STATES) + 1) as executor:
+        jobs = []
+        if "feiertage" in targets:
+            jobs.append(executor.submit(generate_feiertage, args.year_start, args.year_end,
+                                        args.feiertage_dir, args.cache_dir, timestamp))
+        if "ferien" in targets:
+            jobs.extend(
+                executor.submit(write_ferien, state, args.year_start, args.year_end,
+                                args.ferien_dir, timestamp)
+                for state in STATES
+            )
+        # result() re-raises the exception of a failed job
+        for job in jobs:
+            job.result()
 
     print("Done.")
 
@@ -0,0 +1,39 @@
+import importlib.util
+import os
+from datetime import date
+
+import pytest
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'generate_feiertage.py')
+
+
+@pytest.fixture(scope='module')
+def generator():
+    spec = importlib.util.spec_from_file_location('generate_feiertage', SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def unfold(folded: str) -> str:
+    return folded.replace('\r\n ', '')
+
+
+@pytest.mark.parametrize('line', [
+    'SUMMARY:' + 'a' * 66 + 'Ü' + 'bc',
+    'SUMMARY:' + 'a' * 67 + 'Ü' + 'bc',
+    'SUMMARY:' + 'ä' * 80,
+    'SUMMARY:' + 'a' * 70 + '€' * 40,
+])
+def test_ics_fold_keeps_multibyte_characters_at_fold_points(generator, line):
+    folded = generator.ics_fold(line)
+
+    assert unfold(folded) == line
+    for i, part in enumerate(folded.split('\r\n')):
+        limit = 75 if i == 0 else 74
+        assert len(part.lstrip(' ').encode('utf-8')) <= limit
+
+
+def test_make_uid_matches_published_calendars(generator):
+    # UIDs must stay stable, otherwise re-imported calendars duplicate every event
+    assert generator.make_uid('Neujahrstag', date(2025, 1, 1)) == 'd9f8bc22'